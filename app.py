@@ -2,24 +2,35 @@ import os
 import re
 import io
 import sys
-import tempfile
 import logging
 import shutil
 import platform
+import tarfile
+import tempfile
+import zipfile
+import zlib
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
 from typing import Tuple, Dict, Any, List, Optional
 
-from PIL import Image, ImageOps
+from PIL import Image, ImageChops, ImageOps
 import pytesseract
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    jsonify, send_file, flash
+    jsonify, send_file, send_from_directory, flash, abort
 )
 from werkzeug.utils import secure_filename
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy.exc import DBAPIError
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 import pdf2image
 
+# Logger for the helpers defined outside create_app().
+logger = logging.getLogger(__name__)
+
 # Configure Tesseract executable path based on the operating system.
 if platform.system() == "Windows":
     tesseract_executable = os.path.join(os.getcwd(), "tesseract", "tesseract.exe")
@@ -39,6 +50,7 @@ else:
 # Import the database and the enhanced models.
 from extensions import db
 from models import Receipt, ReceiptItem
+from storage import BlobStore
 
 #########################################
 #         Regex Helper Functions        #
@@ -98,6 +110,255 @@ def extract_items(lines: List[str]) -> List[Dict[str, str]]:
     return items
 
 
+def extract_receipt_details(ocr_text: str,
+                            line_numbers: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """
+    Extract receipt details such as merchant name, bill number, date, items,
+    total amount, tax, discount, and location from the OCR text using regex functions.
+    If line_numbers is given, it is filled with the index (among non-empty
+    lines) of the line each field was extracted from.
+    """
+    if line_numbers is None:
+        line_numbers = {}
+    details: Dict[str, Any] = {
+        'bill_no': None,
+        'merchant': None,
+        'date_time': None,
+        'items': [],
+        'total_amount': None,
+        'tax': None,
+        'discount': None,
+        'location': None
+    }
+
+    # Split the OCR text into lines for easier processing.
+    lines = [line.strip() for line in ocr_text.splitlines() if line.strip()]
+
+    # --- Merchant Extraction ---
+    # Try to find a merchant name using a simple alphabetic pattern.
+    merchant = None
+    for index, line in enumerate(lines):
+        if re.match(r'^[A-Za-z\s&\-.]+$', line):
+            merchant = line
+            line_numbers['merchant'] = index
+            break
+    if not merchant and lines:
+        merchant = lines[0]
+        line_numbers['merchant'] = 0
+    details['merchant'] = merchant
+
+    # --- Bill/Invoice Number Extraction ---
+    bill_no_patterns = [
+        r'\b(?:Bill|Invoice)\s*(?:No\.?|#)[:\s]*([\w-]+)'
+    ]
+    bill_no = None
+    for index, line in enumerate(lines):
+        bill_no = multi_regex_extract(line, bill_no_patterns, group=1)
+        if bill_no:
+            line_numbers['bill_no'] = index
+            break
+    details['bill_no'] = bill_no
+
+    # --- Date/Time Extraction ---
+    date_patterns = [
+        r'\b(?P<day>\d{1,2})[/-](?P<month>\d{1,2})[/-](?P<year>\d{2,4})\b',
+        r'\b(?P<year>\d{4})[/-](?P<month>\d{1,2})[/-](?P<day>\d{1,2})\b'
+    ]
+    date_time = None
+    for index, line in enumerate(lines):
+        # Use group 0 to capture the entire matched date string.
+        date_time = multi_regex_extract(line, date_patterns, group=0)
+        if date_time:
+            line_numbers['date_time'] = index
+            break
+    details['date_time'] = date_time
+
+    # --- Total Amount Extraction ---
+    total_patterns = [
+        r'\b(?:TOTAL|Grand Total|AMOUNT|Amount)\b[^\d\$€£]*([\$€£]?\s*\d{1,3}(?:[,\s]\d{3})*(?:\.\d{2})?)',
+        r'([\$€£]\s*\d{1,3}(?:[,\s]\d{3})*(?:\.\d{2}))\s*(?:TOTAL|Grand Total)?'
+    ]
+    total_amount = None
+    for index, line in enumerate(lines):
+        total_amount = multi_regex_extract(line, total_patterns, group=1)
+        if total_amount:
+            line_numbers['total_amount'] = index
+            break
+    details['total_amount'] = total_amount
+
+    # --- Tax Extraction ---
+    tax_pattern = r'\b(?:Tax|VAT)\b[^\d\$€£]*([\$€£]?\s*\d{1,3}(?:[,\s]\d{3})*(?:\.\d{2})?)'
+    tax = None
+    for index, line in enumerate(lines):
+        tax = regex_extract(line, tax_pattern, group=1)
+        if tax:
+            line_numbers['tax'] = index
+            break
+    details['tax'] = tax
+
+    # --- Discount Extraction ---
+    discount_pattern = r'\b(?:Discount|Disc\.?)\b[^\d\$€£]*([\$€£]?\s*\d{1,3}(?:[,\s]\d{3})*(?:\.\d{2})?)'
+    discount = None
+    for index, line in enumerate(lines):
+        discount = regex_extract(line, discount_pattern, group=1)
+        if discount:
+            line_numbers['discount'] = index
+            break
+    details['discount'] = discount
+
+    # --- Items Extraction ---
+    details['items'] = extract_items(lines)
+
+    return details
+
+
+def field_boxes(details: Dict[str, Any], layout: Dict[str, Any]) -> Dict[str, List[int]]:
+    """
+    Map each extracted field to the bounding box of the OCR line it came
+    from, by re-running the extraction over the layout lines and recording
+    which line matched each field's pattern.
+    """
+    lines = [line for line in layout['lines'] if line['text'].strip()]
+    line_numbers: Dict[str, int] = {}
+    located = extract_receipt_details('\n'.join(line['text'] for line in lines), line_numbers)
+    boxes = {}
+    for field, index in line_numbers.items():
+        if details.get(field) and located.get(field) == details.get(field):
+            boxes[field] = lines[index]['box']
+    return boxes
+
+
+#########################################
+#          OCR Layout Functions         #
+#########################################
+def find_text_regions(bin_img: Image.Image) -> List[Tuple[int, int, int, int]]:
+    """
+    Find text blocks in a thresholded image using projection profiles.
+    Columns that are mostly ink (page edges, shadows) are blanked first, then rows with
+    ink are grouped into bands. Bands that are mostly ink (solid fills),
+    barcodes, dense logos and thin slivers (rules, edge noise) are skipped,
+    and text bands separated by normal line spacing are merged into blocks.
+    Returns (left, top, right, bottom) boxes in top-to-bottom order.
+    """
+    gray = bin_img.convert('L')
+    width, height = gray.size
+    # A box-filtered resize to a single row/column gives per-column/per-row means.
+    col_ink = [1 - v / 255 for v in gray.resize((width, 1), Image.BOX).getdata()]
+    border_mask = Image.new('L', (width, 1))
+    border_mask.putdata([255 if v > 0.3 else 0 for v in col_ink])
+    page = ImageChops.lighter(gray, border_mask.resize((width, height)))
+    row_ink = [1 - v / 255 for v in page.resize((1, height), Image.BOX).getdata()]
+
+    bands = []
+    start = None
+    for y, ink in enumerate(row_ink + [0.0]):
+        if ink > 0.005 and start is None:
+            start = y
+        elif ink <= 0.005 and start is not None:
+            if y - start >= 3:
+                bands.append((start, y))
+            start = None
+    if not bands:
+        return []
+
+    heights = sorted(bottom - top for top, bottom in bands)
+    line_height = heights[len(heights) // 2]
+    blocks: List[List[int]] = []
+    previous_skipped = False
+    for top, bottom in bands:
+        band_height = bottom - top
+        band_cols = [1 - v / 255 for v in page.crop((0, top, width, bottom)).resize(
+            (width, 1), Image.BOX).getdata()]
+        # Ignore isolated specks when finding the band's horizontal extent.
+        inked = [i for i, v in enumerate(band_cols) if v > 0.03]
+        if band_height < max(line_height // 3, 3) or not inked:
+            previous_skipped = True
+            continue
+        left, right = inked[0], inked[-1] + 1
+        extent = band_cols[left:right]
+        # Ink coverage within the band's own extent: printed text stays well
+        # below half, solid logos do not. Barcodes have many columns inked
+        # over the full band height, which text lines of several rows lack.
+        density = sum(extent) / len(extent)
+        full_columns = sum(1 for v in extent if v > 0.9) / len(extent)
+        if (density > 0.5 or (band_height > 4 * line_height and density > 0.3)
+                or (band_height > 2 * line_height and full_columns > 0.2)):
+            previous_skipped = True
+            continue
+        if blocks and not previous_skipped and top - blocks[-1][3] <= line_height:
+            block = blocks[-1]
+            block[0], block[2], block[3] = min(block[0], left), max(block[2], right), bottom
+        else:
+            blocks.append([left, top, right, bottom])
+        previous_skipped = False
+
+    # Pad each block, but never past half the gap to its neighbours so
+    # no text line ends up in two crops.
+    pad = max(line_height // 2, 4)
+    regions = []
+    for i, (left, top, right, bottom) in enumerate(blocks):
+        pad_top = min(pad, (top - blocks[i - 1][3]) // 2) if i > 0 else pad
+        pad_bottom = min(pad, (blocks[i + 1][1] - bottom) // 2) if i + 1 < len(blocks) else pad
+        regions.append((max(left - pad, 0), max(top - pad_top, 0),
+                        min(right + pad, width), min(bottom + pad_bottom, height)))
+    return regions
+
+
+def ocr_lines(img: Image.Image, config: str = '') -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Run Tesseract on an image and group the recognized words into lines.
+    Returns the lines (each with its text and word boxes) in reading order,
+    along with the mean word confidence (0-100).
+    """
+    data = pytesseract.image_to_data(img, config=config, output_type=pytesseract.Output.DICT)
+    lines: Dict[Tuple[int, int, int], Dict[str, Any]] = {}
+    confidences = []
+    for i, word in enumerate(data['text']):
+        word = word.strip()
+        conf = float(data['conf'][i])
+        if not word or conf < 0:
+            continue
+        confidences.append(conf)
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        box = (data['left'][i], data['top'][i],
+               data['left'][i] + data['width'][i], data['top'][i] + data['height'][i])
+        lines.setdefault(key, {'words': []})['words'].append((word, box))
+    for line in lines.values():
+        line['text'] = ' '.join(word for word, _ in line['words'])
+    mean_conf = sum(confidences) / len(confidences) if confidences else 0.0
+    return list(lines.values()), mean_conf
+
+
+def ocr_regions(bin_img: Image.Image, config: str = '',
+                executor: Optional[ThreadPoolExecutor] = None) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    OCR only the text regions of an image, in parallel on the given executor
+    or one after another in the calling thread. Word boxes are returned in
+    whole-image coordinates and lines keep reading order. Falls back to the
+    whole image when no text region is found.
+    """
+    regions = find_text_regions(bin_img)
+    if not regions:
+        return ocr_lines(bin_img, config=config)
+    crops = [bin_img.crop(region) for region in regions]
+    if executor:
+        results = list(executor.map(ocr_lines, crops, [config] * len(crops)))
+    else:
+        results = [ocr_lines(crop, config) for crop in crops]
+    lines: List[Dict[str, Any]] = []
+    weighted_conf = 0.0
+    word_count = 0
+    for region, (region_lines, conf) in zip(regions, results):
+        for line in region_lines:
+            line['words'] = [(word, (box[0] + region[0], box[1] + region[1], box[2] + region[0], box[3] + region[1]))
+                             for word, box in line['words']]
+            weighted_conf += conf * len(line['words'])
+            word_count += len(line['words'])
+        lines.extend(region_lines)
+    logger.debug(f"OCR'd {len(regions)} text region(s)")
+    return lines, weighted_conf / word_count if word_count else 0.0
+
+
 #########################################
 #        Helper Conversion Functions    #
 #########################################
@@ -133,6 +394,32 @@ def parse_decimal(value: Optional[str]) -> Decimal:
         return Decimal('0.00')
 
 
+def upgrade_schema() -> None:
+    """
+    Add columns introduced after a database was created. create_all() only
+    creates missing tables, so nullable columns are added with ALTER TABLE.
+    Safe to run from several worker processes at once: a column another
+    process added in the meantime is left alone.
+    """
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            except DBAPIError:
+                # Raised as "duplicate column name" when another worker won the race.
+                current = {c['name'] for c in db.inspect(db.engine).get_columns(table.name)}
+                if column.name not in current:
+                    raise
+
+
 #########################################
 #            Application Setup          #
 #########################################
@@ -148,6 +435,40 @@ def create_app() -> Flask:
         UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
         MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB limit
         ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
+        # Batch API: comma-separated keys allowed to call /api/receipts/batch.
+        API_KEYS = {k.strip() for k in os.getenv('API_KEYS', '').split(',') if k.strip()}
+        BATCH_MAX_CONTENT_LENGTH = int(os.getenv('BATCH_MAX_CONTENT_LENGTH', 256 * 1024 * 1024))
+        # Shared OCR pool used by the batch API, and how many of its workers
+        # one API key may occupy at a time (leaves headroom for other users).
+        OCR_MAX_WORKERS = int(os.getenv('OCR_MAX_WORKERS', 4))
+        API_KEY_MAX_CONCURRENCY = int(os.getenv('API_KEY_MAX_CONCURRENCY', 2))
+        # Uploads waiting for an OCR slot are spooled (in memory up to
+        # BATCH_SPOOL_MEMORY bytes each, then on disk); at most
+        # API_KEY_MAX_QUEUED uploads totalling API_KEY_MAX_QUEUED_BYTES may
+        # wait per key. Finished jobs that are never polled are forgotten
+        # after BATCH_JOB_TTL seconds or beyond BATCH_MAX_JOBS.
+        BATCH_SPOOL_MEMORY = int(os.getenv('BATCH_SPOOL_MEMORY', 1024 * 1024))
+        API_KEY_MAX_QUEUED = int(os.getenv('API_KEY_MAX_QUEUED', 1000))
+        API_KEY_MAX_QUEUED_BYTES = int(os.getenv('API_KEY_MAX_QUEUED_BYTES', 128 * 1024 * 1024))
+        BATCH_JOB_TTL = int(os.getenv('BATCH_JOB_TTL', 3600))
+        BATCH_MAX_JOBS = int(os.getenv('BATCH_MAX_JOBS', 10000))
+        # Tiered OCR: a fast pass on a downscaled image, retried at full
+        # resolution only when confidence is low or key fields are missing.
+        OCR_FAST_MAX_SIDE = int(os.getenv('OCR_FAST_MAX_SIDE', 1600))
+        OCR_FAST_PSM = int(os.getenv('OCR_FAST_PSM', 4))  # single column of variable-size text
+        OCR_MIN_CONFIDENCE = float(os.getenv('OCR_MIN_CONFIDENCE', 75))
+        # Text regions found by the layout stage are OCR'd concurrently for
+        # interactive requests; batch jobs OCR them within their OCR_MAX_WORKERS slot.
+        OCR_REGION_WORKERS = int(os.getenv('OCR_REGION_WORKERS', 4))
+        # Upload storage retention. Originals linked to a receipt are kept for
+        # UPLOAD_RETENTION_DAYS (0 keeps them forever); derived artifacts and
+        # unlinked uploads expire sooner. The sweeper runs every
+        # STORAGE_SWEEP_INTERVAL seconds (0 disables it); a lock file in
+        # UPLOAD_FOLDER keeps worker processes from sweeping at the same time.
+        UPLOAD_RETENTION_DAYS = int(os.getenv('UPLOAD_RETENTION_DAYS', 0))
+        DERIVED_RETENTION_HOURS = int(os.getenv('DERIVED_RETENTION_HOURS', 24))
+        ORPHAN_GRACE_HOURS = int(os.getenv('ORPHAN_GRACE_HOURS', 24))
+        STORAGE_SWEEP_INTERVAL = int(os.getenv('STORAGE_SWEEP_INTERVAL', 3600))
         POPPLER_PATH = os.getenv('POPPLER_PATH') or os.path.abspath(
             os.path.join(os.getcwd(), "poppler-24.08.0", "Library", "bin")
         )
@@ -156,6 +477,7 @@ def create_app() -> Flask:
     db.init_app(app)
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     app.logger.setLevel(logging.DEBUG)
+    store = BlobStore(app.config['UPLOAD_FOLDER'])
 
     def allowed_file(filename: str) -> bool:
         """
@@ -166,133 +488,127 @@ def create_app() -> Flask:
             filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
         )
 
-    def preprocess_image(file_path: str) -> str:
-        """
-        Preprocess the image by converting it to grayscale and applying a threshold.
-        Returns the path to the preprocessed image.
-        """
-        try:
-            with Image.open(file_path) as img:
-                gray_img = ImageOps.grayscale(img)
-                # Apply a simple binary threshold
-                threshold_img = gray_img.point(lambda x: 0 if x < 128 else 255, mode='1')
-                preprocessed_path = f"{os.path.splitext(file_path)[0]}_preprocessed.jpg"
-                threshold_img.save(preprocessed_path)
-                app.logger.debug(f"Preprocessed image saved at {preprocessed_path}")
-                return preprocessed_path
-        except Exception as e:
-            app.logger.exception(f"Error preprocessing image {file_path}: {e}")
-            raise
-
-    def ocr_receipt(file_path: str) -> Tuple[str, str]:
+    def threshold_image(img: Image.Image) -> Image.Image:
         """
-        Perform OCR on an image file after preprocessing. Save the OCR output
-        to a text file and return both the OCR text and the text file path.
+        Convert an in-memory image to grayscale and apply a binary threshold.
         """
-        try:
-            preprocessed_path = preprocess_image(file_path)
-            with Image.open(preprocessed_path) as processed_img:
-                ocr_text = pytesseract.image_to_string(processed_img)
-            text_file_path = f"{os.path.splitext(file_path)[0]}.txt"
-            with open(text_file_path, 'w', encoding='utf-8') as f:
-                f.write(ocr_text)
-            app.logger.debug(f"OCR text saved at {text_file_path}")
-            return ocr_text, text_file_path
-        except Exception as e:
-            app.logger.exception(f"OCR error processing {file_path}: {e}")
-            return "", ""
+        gray_img = ImageOps.grayscale(img)
+        # Apply a simple binary threshold
+        return gray_img.point(lambda x: 0 if x < 128 else 255, mode='1')
 
-    # Alias for clarity.
-    perform_ocr = ocr_receipt
+    # Pool for OCR'ing the text regions of a single image in parallel, used
+    # only by interactive requests (/upload, /ocr_preview). Batch jobs OCR
+    # their regions inside their own ocr_executor slot, so a bulk load can
+    # never queue region crops ahead of an interactive user's.
+    region_executor = ThreadPoolExecutor(max_workers=app.config['OCR_REGION_WORKERS'],
+                                         thread_name_prefix='ocr-region')
 
-    def extract_receipt_details(ocr_text: str) -> Dict[str, Any]:
+    def refine_total_lines(lines: List[Dict[str, Any]], full_img: Image.Image, scale: float) -> None:
         """
-        Extract receipt details such as merchant name, bill number, date, items,
-        total amount, tax, discount, and location from the OCR text using regex functions.
+        Re-read the amount on total lines whose value could not be parsed,
+        using a numeric/currency whitelist on the region right of the keyword.
+        Updates the line text in place.
         """
-        details: Dict[str, Any] = {
-            'bill_no': None,
-            'merchant': None,
-            'date_time': None,
-            'items': [],
-            'total_amount': None,
-            'tax': None,
-            'discount': None,
-            'location': None
-        }
-
-        # Split the OCR text into lines for easier processing.
-        lines = [line.strip() for line in ocr_text.splitlines() if line.strip()]
-
-        # --- Merchant Extraction ---
-        # Try to find a merchant name using a simple alphabetic pattern.
-        merchant = None
+        keyword = re.compile(r'^(?:TOTAL|AMOUNT)[:]?$', re.IGNORECASE)
         for line in lines:
-            if re.match(r'^[A-Za-z\s&\-.]+$', line):
-                merchant = line
+            if extract_receipt_details(line['text']).get('total_amount'):
+                continue
+            for idx, (word, box) in enumerate(line['words']):
+                if not keyword.match(word):
+                    continue
+                # Line region right of the keyword, mapped back to full resolution.
+                top = min(b[1] for _, b in line['words']) * scale
+                bottom = max(b[3] for _, b in line['words']) * scale
+                crop = full_img.crop((int(box[2] * scale), max(int(top) - 4, 0),
+                                      full_img.width, min(int(bottom) + 4, full_img.height)))
+                amount = pytesseract.image_to_string(
+                    crop, config='--psm 7 -c tessedit_char_whitelist=0123456789.,$€£'
+                ).strip()
+                if re.search(r'\d', amount):
+                    line['text'] = ' '.join([w for w, _ in line['words'][:idx + 1]] + [amount])
                 break
-        if not merchant and lines:
-            merchant = lines[0]
-        details['merchant'] = merchant
 
-        # --- Bill/Invoice Number Extraction ---
-        bill_no_patterns = [
-            r'\b(?:Bill|Invoice)\s*(?:No\.?|#)[:\s]*([\w-]+)'
-        ]
-        bill_no = None
-        for line in lines:
-            bill_no = multi_regex_extract(line, bill_no_patterns, group=1)
-            if bill_no:
-                break
-        details['bill_no'] = bill_no
+    def line_boxes(lines: List[Dict[str, Any]], scale: float) -> List[Dict[str, Any]]:
+        """
+        Reduce OCR lines to their text and bounding box, scaled to full resolution.
+        """
+        return [{
+            'text': line['text'],
+            'box': [int(min(b[0] for _, b in line['words']) * scale),
+                    int(min(b[1] for _, b in line['words']) * scale),
+                    int(max(b[2] for _, b in line['words']) * scale),
+                    int(max(b[3] for _, b in line['words']) * scale)]
+        } for line in lines]
 
-        # --- Date/Time Extraction ---
-        date_patterns = [
-            r'\b(?P<day>\d{1,2})[/-](?P<month>\d{1,2})[/-](?P<year>\d{2,4})\b',
-            r'\b(?P<year>\d{4})[/-](?P<month>\d{1,2})[/-](?P<day>\d{1,2})\b'
-        ]
-        date_time = None
-        for line in lines:
-            # Use group 0 to capture the entire matched date string.
-            date_time = multi_regex_extract(line, date_patterns, group=0)
-            if date_time:
-                break
-        details['date_time'] = date_time
+    def ocr_image(img: Image.Image, parallel: bool = True) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Tiered OCR for a receipt image. A fast first pass runs on the text regions
+        of a downscaled, thresholded copy; the whole image is only re-OCR'd at full
+        resolution when the mean confidence is below OCR_MIN_CONFIDENCE or no total
+        or date is found. Regions are OCR'd on region_executor unless parallel is
+        False. Returns the text and its lines with bounding boxes in original
+        image coordinates.
+        """
+        gray_img = ImageOps.grayscale(img)
+        full_img = threshold_image(gray_img)
+        scale = max(gray_img.size) / app.config['OCR_FAST_MAX_SIDE']
+        if scale > 1:
+            fast_size = (round(gray_img.width / scale), round(gray_img.height / scale))
+            fast_img = threshold_image(gray_img.resize(fast_size, Image.LANCZOS))
+        else:
+            scale = 1.0
+            fast_img = full_img
 
-        # --- Total Amount Extraction ---
-        total_patterns = [
-            r'\b(?:TOTAL|Grand Total|AMOUNT|Amount)\b[^\d\$€£]*([\$€£]?\s*\d{1,3}(?:[,\s]\d{3})*(?:\.\d{2})?)',
-            r'([\$€£]\s*\d{1,3}(?:[,\s]\d{3})*(?:\.\d{2}))\s*(?:TOTAL|Grand Total)?'
-        ]
-        total_amount = None
-        for line in lines:
-            total_amount = multi_regex_extract(line, total_patterns, group=1)
-            if total_amount:
-                break
-        details['total_amount'] = total_amount
+        lines, conf = ocr_regions(fast_img, config=f"--psm {app.config['OCR_FAST_PSM']}",
+                                  executor=region_executor if parallel else None)
+        refine_total_lines(lines, full_img, scale)
+        text = '\n'.join(line['text'] for line in lines)
+        details = extract_receipt_details(text)
+        found = bool(details.get('total_amount')) + bool(details.get('date_time'))
+        if conf >= app.config['OCR_MIN_CONFIDENCE'] and found == 2:
+            app.logger.debug(f"Fast OCR pass accepted (confidence {conf:.1f})")
+            return text, line_boxes(lines, scale)
 
-        # --- Tax Extraction ---
-        tax_pattern = r'\b(?:Tax|VAT)\b[^\d\$€£]*([\$€£]?\s*\d{1,3}(?:[,\s]\d{3})*(?:\.\d{2})?)'
-        tax = None
-        for line in lines:
-            tax = regex_extract(line, tax_pattern, group=1)
-            if tax:
-                break
-        details['tax'] = tax
+        app.logger.debug(f"Fast OCR pass rejected (confidence {conf:.1f}, {found}/2 key fields); retrying")
+        retry_lines, retry_conf = ocr_lines(full_img)
+        retry_text = '\n'.join(line['text'] for line in retry_lines)
+        retry_details = extract_receipt_details(retry_text)
+        retry_found = bool(retry_details.get('total_amount')) + bool(retry_details.get('date_time'))
+        if (retry_found, retry_conf) >= (found, conf):
+            return retry_text, line_boxes(retry_lines, 1.0)
+        return text, line_boxes(lines, scale)
 
-        # --- Discount Extraction ---
-        discount_pattern = r'\b(?:Discount|Disc\.?)\b[^\d\$€£]*([\$€£]?\s*\d{1,3}(?:[,\s]\d{3})*(?:\.\d{2})?)'
-        discount = None
-        for line in lines:
-            discount = regex_extract(line, discount_pattern, group=1)
-            if discount:
-                break
-        details['discount'] = discount
+    def ocr_receipt_layout(file_path: str) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+        """
+        Perform tiered OCR (see ocr_image) on an image file. Save the OCR output
+        to a text file and return the OCR text, the text file path and the page
+        layout (image size and line bounding boxes).
+        """
+        try:
+            with Image.open(file_path) as img:
+                ocr_text, lines = ocr_image(img)
+                layout = {'width': img.width, 'height': img.height, 'lines': lines}
+            text_file_path = f"{os.path.splitext(file_path)[0]}.txt"
+            temp_path = store.temp_path(suffix='.txt')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(ocr_text)
+            store.commit_temp(temp_path, text_file_path)
+            app.logger.debug(f"OCR text saved at {text_file_path}")
+            return ocr_text, text_file_path, layout
+        except Exception as e:
+            app.logger.exception(f"OCR error processing {file_path}: {e}")
+            return "", "", None
 
-        # --- Items Extraction ---
-        details['items'] = extract_items(lines)
+    def ocr_receipt(file_path: str) -> Tuple[str, str]:
+        """
+        Perform tiered OCR (see ocr_image) on an image file. Save the OCR output
+        to a text file and return both the OCR text and the text file path.
+        """
+        ocr_text, text_file_path, _ = ocr_receipt_layout(file_path)
+        return ocr_text, text_file_path
 
-        return details
+    # Alias for clarity.
+    perform_ocr = ocr_receipt
 
     def categorize_expense(merchant: Optional[str], items: List[Dict[str, str]]) -> str:
         """
@@ -314,8 +630,8 @@ def create_app() -> Flask:
 
     def process_pdf(file_path: str) -> str:
         """
-        Convert a PDF file to images using Poppler, perform OCR on each page,
-        and aggregate the OCR text.
+        Convert a PDF file to images using Poppler, perform OCR on each page
+        in memory, and aggregate the OCR text.
         """
         full_ocr_text = ""
         try:
@@ -324,36 +640,81 @@ def create_app() -> Flask:
             images = pdf2image.convert_from_path(file_path, poppler_path=poppler_path)
             app.logger.debug(f"Converted PDF to {len(images)} image(s).")
             for idx, image in enumerate(images):
-                with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
-                    temp_image_path = temp_file.name
                 try:
-                    image.save(temp_image_path, format='PNG')
-                    app.logger.debug(f"Saved temporary image for PDF page {idx + 1}: {temp_image_path}")
-                    page_text, _ = perform_ocr(temp_image_path)
+                    page_text, _ = ocr_image(image)
                     full_ocr_text += page_text + "\n"
                 except Exception as e:
                     app.logger.exception(f"Error processing PDF page {idx + 1}: {e}")
-                finally:
-                    try:
-                        os.remove(temp_image_path)
-                        app.logger.debug(f"Removed temporary file: {temp_image_path}")
-                    except OSError as e:
-                        app.logger.error(f"Error removing temporary file {temp_image_path}: {e}")
         except Exception as e:
             app.logger.exception(f"Error converting PDF {file_path}: {e}")
         return full_ocr_text
 
+    def save_receipt(ocr_text: str, details: Dict[str, Any], source: str,
+                     layout: Optional[Dict[str, Any]] = None,
+                     source_file: Optional[str] = None) -> Optional[Receipt]:
+        """
+        Save a receipt and its items from extracted details. Must be called
+        inside an application context. Returns None on database errors.
+        """
+        ocr_layout = None
+        if layout:
+            ocr_layout = {'width': layout['width'], 'height': layout['height'],
+                          'fields': field_boxes(details, layout)}
+        if not details.get('merchant'):
+            details['merchant'] = "Unknown Merchant"
+        category = categorize_expense(details.get('merchant'), details.get('items'))
+
+        receipt_date = parse_date(details.get('date_time'))
+        total_amt = parse_decimal(details.get('total_amount'))
+        tax_amt = parse_decimal(details.get('tax'))
+        discount_amt = parse_decimal(details.get('discount'))
+
+        try:
+            receipt = Receipt(
+                bill_no=details.get('bill_no'),
+                merchant=details.get('merchant'),
+                date_time=receipt_date,
+                total_amount=total_amt,
+                tax=tax_amt,
+                discount=discount_amt,
+                ocr_text=ocr_text,
+                category=category,
+                location=details.get('location'),
+                source_file=source_file,
+                ocr_layout=ocr_layout
+            )
+            db.session.add(receipt)
+            db.session.commit()
+
+            # Process individual receipt items.
+            for item in details.get('items', []):
+                if item.get('name') and item.get('amount'):
+                    receipt_item = ReceiptItem(
+                        receipt_id=receipt.id,
+                        name=item.get('name'),
+                        amount=parse_decimal(item.get('amount'))
+                    )
+                    db.session.add(receipt_item)
+            db.session.commit()
+            app.logger.info(f"Successfully processed receipt with ID: {receipt.id}")
+            return receipt
+        except Exception as e:
+            app.logger.exception(f"Database error processing {source}: {e}")
+            db.session.rollback()
+            return None
+
     def process_receipt_file(file_path: str) -> Optional[Receipt]:
         """
         Process an uploaded receipt file (PDF or image), perform OCR, extract details,
         and save the receipt and its items to the database.
         """
         with app.app_context():
+            layout = None
             try:
                 if file_path.lower().endswith('.pdf'):
                     ocr_text = process_pdf(file_path)
                 else:
-                    ocr_text, _ = perform_ocr(file_path)
+                    ocr_text, _, layout = ocr_receipt_layout(file_path)
             except Exception as e:
                 app.logger.exception(f"Error processing file {file_path}: {e}")
                 return None
@@ -363,46 +724,272 @@ def create_app() -> Flask:
                 return None
 
             details = extract_receipt_details(ocr_text)
-            if not details.get('merchant'):
-                details['merchant'] = "Unknown Merchant"
-            category = categorize_expense(details.get('merchant'), details.get('items'))
+            source_file = os.path.relpath(file_path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+            return save_receipt(ocr_text, details, file_path, layout=layout, source_file=source_file)
 
-            receipt_date = parse_date(details.get('date_time'))
-            total_amt = parse_decimal(details.get('total_amount'))
-            tax_amt = parse_decimal(details.get('tax'))
-            discount_amt = parse_decimal(details.get('discount'))
+    def ocr_bytes(filename: str, data: bytes) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Perform OCR on an in-memory receipt (PDF or image) without writing
+        the original or any intermediate image to disk. Returns the OCR text
+        and, for images, the page layout. PDFs get no layout, since the stored
+        original cannot be shown as an image. Used by batch jobs, which
+        already hold an OCR slot, so regions are OCR'd in the calling thread.
+        """
+        is_pdf = filename.lower().endswith('.pdf')
+        if is_pdf:
+            images = pdf2image.convert_from_bytes(data, poppler_path=app.config['POPPLER_PATH'])
+        else:
+            images = [Image.open(io.BytesIO(data))]
+        page_texts = []
+        layout = None
+        for image in images:
+            with image:
+                page_text, lines = ocr_image(image, parallel=False)
+                page_texts.append(page_text)
+                if not is_pdf:
+                    layout = {'width': image.width, 'height': image.height, 'lines': lines}
+        return "\n".join(page_texts), layout
 
+    def process_receipt_bytes(filename: str, data: bytes) -> Dict[str, Any]:
+        """
+        OCR an in-memory receipt, save it, and return a JSON-serializable result
+        holding the receipt ID and the fields from extract_receipt_details.
+        """
+        result: Dict[str, Any] = {'filename': filename, 'status': 'failed', 'receipt_id': None, 'details': None}
+        with app.app_context():
             try:
-                receipt = Receipt(
-                    bill_no=details.get('bill_no'),
-                    merchant=details.get('merchant'),
-                    date_time=receipt_date,
-                    total_amount=total_amt,
-                    tax=tax_amt,
-                    discount=discount_amt,
-                    ocr_text=ocr_text,
-                    category=category,
-                    location=details.get('location')
-                )
-                db.session.add(receipt)
-                db.session.commit()
+                ocr_text, layout = ocr_bytes(filename, data)
+            except Exception as e:
+                app.logger.exception(f"Error processing file {filename}: {e}")
+                result['error'] = 'OCR failed.'
+                return result
 
-                # Process individual receipt items.
-                for item in details.get('items', []):
-                    if item.get('name') and item.get('amount'):
-                        receipt_item = ReceiptItem(
-                            receipt_id=receipt.id,
-                            name=item.get('name'),
-                            amount=parse_decimal(item.get('amount'))
-                        )
-                        db.session.add(receipt_item)
-                db.session.commit()
-                app.logger.info(f"Successfully processed receipt with ID: {receipt.id}")
-                return receipt
+            if not ocr_text.strip():
+                app.logger.warning(f"No OCR text extracted from {filename}")
+                result['error'] = 'No text extracted.'
+                return result
+
+            details = extract_receipt_details(ocr_text)
+            _, source_file = store.put_bytes(data, filename.rsplit('.', 1)[-1])
+            receipt = save_receipt(ocr_text, details, filename, layout=layout, source_file=source_file)
+            result['details'] = details
+            if receipt is None:
+                result['error'] = 'Database error.'
+                return result
+            result['status'] = 'processed'
+            result['receipt_id'] = receipt.id
+            return result
+
+    #########################################
+    #         Batch API Infrastructure      #
+    #########################################
+    # OCR pool shared by all batch API callers. Each API key may only hold
+    # API_KEY_MAX_CONCURRENCY slots at once, so one bulk load cannot occupy
+    # every worker while other keys or interactive users are waiting. Jobs
+    # beyond that wait in a per-key queue and are dispatched as slots free up,
+    # so requests never block on a slot.
+    ocr_executor = ThreadPoolExecutor(max_workers=app.config['OCR_MAX_WORKERS'],
+                                      thread_name_prefix='ocr')
+    api_key_queues: Dict[str, Dict[str, Any]] = {}
+    api_key_queues_lock = threading.Lock()
+    # job_id -> (api_key, future, created_at), oldest first.
+    batch_jobs: 'OrderedDict[str, Tuple[str, Future, float]]' = OrderedDict()
+    batch_jobs_lock = threading.Lock()
+
+    # Errors raised by corrupt, truncated or encrypted archives.
+    archive_errors = (zipfile.BadZipFile, tarfile.TarError, RuntimeError, zlib.error, EOFError, OSError)
+
+    def run_batch_job(api_key: str, filename: str, spool: Any, size: int, handle: Future) -> None:
+        """
+        Process one spooled upload on the OCR pool, then free the key's slot
+        and dispatch its next queued job.
+        """
+        try:
+            if handle.set_running_or_notify_cancel():
+                try:
+                    spool.seek(0)
+                    handle.set_result(process_receipt_bytes(filename, spool.read()))
+                except Exception as e:
+                    app.logger.exception(f"Error processing a receipt: {e}")
+                    handle.set_exception(e)
+        finally:
+            spool.close()
+            with api_key_queues_lock:
+                api_key_queues[api_key]['in_flight'] -= 1
+                api_key_queues[api_key]['queued_bytes'] -= size
+            dispatch_batch_jobs(api_key)
+
+    def dispatch_batch_jobs(api_key: str) -> None:
+        """
+        Move queued jobs of an API key onto the OCR pool while it has free slots.
+        """
+        ready = []
+        with api_key_queues_lock:
+            state = api_key_queues[api_key]
+            while state['in_flight'] < app.config['API_KEY_MAX_CONCURRENCY'] and state['pending']:
+                ready.append(state['pending'].popleft())
+                state['in_flight'] += 1
+        for filename, spool, size, handle in ready:
+            ocr_executor.submit(run_batch_job, api_key, filename, spool, size, handle)
+
+    def spool_upload(stream: Any, chunk_size: int = 64 * 1024) -> Optional[Any]:
+        """
+        Copy an upload or archive member into a spooled temporary file.
+        Returns None, without reading further, once it exceeds MAX_CONTENT_LENGTH.
+        """
+        max_size = app.config['MAX_CONTENT_LENGTH']
+        spool = tempfile.SpooledTemporaryFile(max_size=app.config['BATCH_SPOOL_MEMORY'])
+        try:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                if spool.tell() + len(chunk) > max_size:
+                    spool.close()
+                    return None
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        return spool
+
+    def queue_batch_job(api_key: str, filename: str, spool: Optional[Any]) -> Any:
+        """
+        Queue a spooled upload for OCR without waiting for a slot. Returns a
+        future for the result, or a skipped result when the upload was too
+        large or the key's queue is full (by count or by queued bytes).
+        """
+        if spool is None:
+            app.logger.warning(f"Skipping oversized upload {filename}")
+            return {'filename': filename, 'status': 'skipped', 'error': 'File too large.'}
+        size = spool.tell()
+        handle: Future = Future()
+        with api_key_queues_lock:
+            state = api_key_queues.setdefault(api_key, {'pending': deque(), 'in_flight': 0, 'queued_bytes': 0})
+            if (len(state['pending']) >= app.config['API_KEY_MAX_QUEUED']
+                    or state['queued_bytes'] + size > app.config['API_KEY_MAX_QUEUED_BYTES']):
+                spool.close()
+                return {'filename': filename, 'status': 'skipped', 'error': 'Queue full, retry later.'}
+            # Bytes stay counted until the job finishes and its spool is closed.
+            state['queued_bytes'] += size
+            state['pending'].append((filename, spool, size, handle))
+        dispatch_batch_jobs(api_key)
+        return handle
+
+    def register_batch_jobs(api_key: str, futures: List[Future]) -> List[str]:
+        """
+        Store the job handles of one request and return their IDs. Finished
+        jobs that were never polled within BATCH_JOB_TTL, and the oldest
+        finished jobs beyond BATCH_MAX_JOBS, are pruned first. Jobs are kept
+        oldest first, so pruning stops at the first job that is still recent
+        while the store is within its cap.
+        """
+        now = time.time()
+        job_ids = [uuid.uuid4().hex for _ in futures]
+        with batch_jobs_lock:
+            room = app.config['BATCH_MAX_JOBS'] - len(futures)
+            expired = []
+            for old_id, (_, old_future, created_at) in batch_jobs.items():
+                if now - created_at <= app.config['BATCH_JOB_TTL'] and len(batch_jobs) - len(expired) <= room:
+                    break
+                if old_future.done():
+                    expired.append(old_id)
+            for old_id in expired:
+                del batch_jobs[old_id]
+            for job_id, future in zip(job_ids, futures):
+                batch_jobs[job_id] = (api_key, future, now)
+        return job_ids
+
+    def iter_archive_members(file) -> Any:
+        """
+        Yield (filename, opener) for each allowed member of a zip or tar upload,
+        where opener() returns a file object reading the member straight from
+        the upload stream. Tar members must be read before the next one is
+        yielded. Members larger than MAX_CONTENT_LENGTH are skipped.
+        """
+        max_member_size = app.config['MAX_CONTENT_LENGTH']
+        name = file.filename.lower()
+        if name.endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as archive:
+                for info in archive.infolist():
+                    member_name = os.path.basename(info.filename)
+                    if info.is_dir() or not allowed_file(member_name):
+                        continue
+                    if info.file_size > max_member_size:
+                        app.logger.warning(f"Skipping oversized archive member {info.filename}")
+                        continue
+                    yield member_name, lambda info=info: archive.open(info)
+        else:
+            # Stream mode ('r|*') reads the tar sequentially, compressed or not.
+            with tarfile.open(fileobj=file.stream, mode='r|*') as archive:
+                for info in archive:
+                    member_name = os.path.basename(info.name)
+                    if not info.isfile() or not allowed_file(member_name):
+                        continue
+                    if info.size > max_member_size:
+                        app.logger.warning(f"Skipping oversized archive member {info.name}")
+                        continue
+                    yield member_name, lambda info=info: archive.extractfile(info)
+
+    def is_archive(filename: str) -> bool:
+        """
+        Check if the uploaded file is a zip or tar archive.
+        """
+        return filename.lower().endswith(('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz'))
+
+    #########################################
+    #         Upload Storage Lifecycle      #
+    #########################################
+    def sweep_storage() -> Dict[str, Any]:
+        """
+        Apply the upload retention policy and unlink each receipt whose
+        original is removed, as soon as it is removed.
+        """
+        with app.app_context():
+            referenced = {
+                source_file for (source_file,) in
+                db.session.query(Receipt.source_file).filter(Receipt.source_file.isnot(None))
+            }
+
+            def unlink_receipts(relative_path: str) -> None:
+                if relative_path not in referenced:
+                    return
+                try:
+                    Receipt.query.filter_by(source_file=relative_path).update(
+                        {'source_file': None}, synchronize_session=False
+                    )
+                    db.session.commit()
+                except Exception as e:
+                    app.logger.exception(f"Error unlinking expired upload {relative_path}: {e}")
+                    db.session.rollback()
+
+            stats = store.sweep(
+                referenced,
+                retention_days=app.config['UPLOAD_RETENTION_DAYS'],
+                derived_retention_hours=app.config['DERIVED_RETENTION_HOURS'],
+                orphan_grace_hours=app.config['ORPHAN_GRACE_HOURS'],
+                on_remove=unlink_receipts
+            )
+            if stats['skipped']:
+                app.logger.debug("Storage sweep skipped: another process is sweeping")
+                return stats
+            app.logger.info(
+                f"Storage sweep removed {len(stats['removed_originals'])} original(s) and "
+                f"{stats['removed_derived']} derived file(s), freeing {stats['freed_bytes']} bytes"
+            )
+            return stats
+
+    def run_storage_sweeper(interval: int) -> None:
+        """
+        Background loop that sweeps upload storage every interval seconds.
+        """
+        while not sweeper_stop.wait(interval):
+            try:
+                sweep_storage()
             except Exception as e:
-                app.logger.exception(f"Database error processing {file_path}: {e}")
-                db.session.rollback()
-                return None
+                app.logger.exception(f"Storage sweep failed: {e}")
+
+    sweeper_stop = threading.Event()
+    if app.config['STORAGE_SWEEP_INTERVAL'] > 0:
+        threading.Thread(target=run_storage_sweeper, args=(app.config['STORAGE_SWEEP_INTERVAL'],),
+                         name='storage-sweeper', daemon=True).start()
 
     #########################################
     #             Application Routes        #
@@ -435,8 +1022,8 @@ def create_app() -> Flask:
                 for file in files:
                     if file and allowed_file(file.filename):
                         filename = secure_filename(file.filename)
-                        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                        file.save(file_path)
+                        _, relative_path = store.put_stream(file.stream, filename.rsplit('.', 1)[-1])
+                        file_path = store.path_for(relative_path)
                         processed_files.append(filename)
                         futures.append(executor.submit(process_receipt_file, file_path))
                     else:
@@ -498,6 +1085,16 @@ def create_app() -> Flask:
             return redirect(url_for('index'))
         return render_template('edit_receipt.html', receipt=receipt)
 
+    @app.route('/receipt/<int:receipt_id>/image')
+    def receipt_image(receipt_id: int):
+        """
+        Serve the uploaded image a receipt was scanned from.
+        """
+        receipt = Receipt.query.get_or_404(receipt_id)
+        if not receipt.source_file:
+            abort(404)
+        return send_from_directory(app.config['UPLOAD_FOLDER'], receipt.source_file)
+
     @app.route('/export/<string:export_format>')
     def export_data(export_format: str):
         """
@@ -537,8 +1134,8 @@ def create_app() -> Flask:
         file = request.files.get('file')
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
+            _, relative_path = store.put_stream(file.stream, filename.rsplit('.', 1)[-1])
+            file_path = store.path_for(relative_path)
             ocr_text, ocr_text_file = perform_ocr(file_path)
             return jsonify({'ocr_text': ocr_text, 'text_file': ocr_text_file})
         return jsonify({'error': 'No file uploaded or file type not allowed.'}), 400
@@ -558,6 +1155,117 @@ def create_app() -> Flask:
         ]
         return jsonify(result)
 
+    @app.route('/api/receipts/batch', methods=['POST'])
+    def api_batch_upload():
+        """
+        Ingest a batch of receipts for programmatic clients. Accepts several
+        'files' parts and/or zip/tar archives, authenticated by the X-API-Key
+        header. With ?mode=async returns job handles to poll at
+        /api/jobs/<job_id> as soon as the upload has been read; with
+        ?mode=sync waits and returns per-file results. Requests containing an
+        archive default to async, since waiting for every member would hold
+        the request open for the whole batch; other requests default to sync.
+        Each file or archive member is limited to MAX_CONTENT_LENGTH.
+        """
+        api_key = request.headers.get('X-API-Key')
+        if not api_key or api_key not in app.config['API_KEYS']:
+            return jsonify({'error': 'Invalid or missing API key.'}), 401
+        request.max_content_length = app.config['BATCH_MAX_CONTENT_LENGTH']
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({'error': 'No files uploaded.'}), 400
+        has_archive = any(file and file.filename and is_archive(file.filename) for file in files)
+        async_mode = request.args.get('mode', 'async' if has_archive else 'sync') == 'async'
+
+        # Each entry is (filename, future) or (filename, result) for files
+        # rejected before OCR, kept in upload order.
+        entries: List[Tuple[str, Any]] = []
+        for file in files:
+            if not file or not file.filename:
+                continue
+            if is_archive(file.filename):
+                # Members already queued keep their handles if the archive
+                # turns out to be corrupt further in.
+                try:
+                    for member_name, open_member in iter_archive_members(file):
+                        member_name = secure_filename(member_name)
+                        try:
+                            with open_member() as member:
+                                spool = spool_upload(member)
+                        except archive_errors as e:
+                            app.logger.warning(f"Unreadable archive member {member_name} in {file.filename}: {e}")
+                            entries.append((member_name, {'filename': member_name, 'status': 'skipped',
+                                                          'error': 'Unreadable archive member.'}))
+                            continue
+                        entries.append((member_name, queue_batch_job(api_key, member_name, spool)))
+                except archive_errors as e:
+                    app.logger.warning(f"Unreadable archive {file.filename}: {e}")
+                    entries.append((file.filename, {'filename': file.filename, 'status': 'skipped',
+                                                    'error': 'Unreadable archive.'}))
+            elif allowed_file(file.filename):
+                filename = secure_filename(file.filename)
+                entries.append((filename, queue_batch_job(api_key, filename, spool_upload(file.stream))))
+            else:
+                app.logger.warning(f"File {file.filename} is not allowed.")
+                entries.append((file.filename, {'filename': file.filename, 'status': 'skipped',
+                                                'error': 'File type not allowed.'}))
+
+        if async_mode:
+            job_ids = iter(register_batch_jobs(
+                api_key, [entry for _, entry in entries if not isinstance(entry, dict)]))
+            jobs = []
+            for filename, entry in entries:
+                if isinstance(entry, dict):
+                    jobs.append(entry)
+                    continue
+                job_id = next(job_ids)
+                jobs.append({
+                    'filename': filename,
+                    'status': 'pending',
+                    'job_id': job_id,
+                    'status_url': url_for('api_job_status', job_id=job_id)
+                })
+            return jsonify({'jobs': jobs}), 202
+
+        results = []
+        for filename, entry in entries:
+            if isinstance(entry, dict):
+                results.append(entry)
+                continue
+            try:
+                results.append(entry.result())
+            except Exception as e:
+                app.logger.exception(f"Error processing a receipt: {e}")
+                results.append({'filename': filename, 'status': 'failed', 'error': 'Processing error.'})
+        return jsonify({'results': results})
+
+    @app.route('/api/jobs/<string:job_id>')
+    def api_job_status(job_id: str):
+        """
+        Return the status of a batch job. Finished jobs are returned once and
+        then forgotten; unpolled ones expire after BATCH_JOB_TTL.
+        """
+        api_key = request.headers.get('X-API-Key')
+        with batch_jobs_lock:
+            job = batch_jobs.get(job_id)
+            if job is None or job[0] != api_key:
+                return jsonify({'error': 'Unknown job.'}), 404
+            future = job[1]
+            if not future.done():
+                return jsonify({'job_id': job_id, 'status': 'pending'})
+            del batch_jobs[job_id]
+        try:
+            result = future.result()
+        except Exception as e:
+            app.logger.exception(f"Error processing a receipt: {e}")
+            result = {'status': 'failed', 'error': 'Processing error.'}
+        return jsonify(dict(result, job_id=job_id))
+
+    @app.route('/storage/usage')
+    def storage_usage():
+        """Report disk usage of the upload storage."""
+        return jsonify(store.usage())
+
     @app.route('/notifications')
     def notifications():
         """Return notifications (currently an empty list)."""
@@ -568,13 +1276,16 @@ def create_app() -> Flask:
         """Serve the service worker script for PWA support."""
         return app.send_static_file('js/service-worker.js')
 
+    # Create missing tables and add columns introduced since the database was created.
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+
     return app
 
 # Create a module-level app variable for WSGI servers.
 app = create_app()
 
-# When running locally, initialize the database and run the server.
+# When running locally, run the development server.
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
     app.run(debug=True)
@@ -0,0 +1,330 @@
+"""
+Local load-testing and concurrency-safety harness for the receipt app.
+
+Drives /upload, /ocr_preview, /, /reports, /voice_search and /export/csv
+in-process with a configurable request mix and concurrency, against a
+throwaway SQLite database and upload folder. Tesseract is replaced by a
+deterministic stub, so runs are repeatable and need no OCR install.
+
+Reports throughput, latency percentiles and error rates per endpoint, and
+flags SQLite lock errors, database connections that were checked out but
+never returned, and successful uploads that saved no receipt or the wrong
+number of items. Exits with status 1 when any gate fails, so it can be
+used as a regression check (CI runs a short one):
+
+    python loadtest.py --requests 500 --concurrency 16 --max-p99-ms 2000
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Any, List, Tuple
+
+from PIL import Image, ImageDraw
+import pytesseract
+
+DEFAULT_MIX = 'upload=1,ocr_preview=1,index=4,reports=2,voice_search=2,export_csv=1'
+
+# Endpoint name -> (method, path, expected status).
+ENDPOINTS = {
+    'upload': ('POST', '/upload', 302),
+    'ocr_preview': ('POST', '/ocr_preview', 200),
+    'index': ('GET', '/', 200),
+    'reports': ('GET', '/reports', 200),
+    'voice_search': ('POST', '/voice_search', 200),
+    'export_csv': ('GET', '/export/csv', 200),
+}
+
+STUB_RECEIPT = [
+    ['GREEN', 'VALLEY', 'MARKET'],
+    ['Bill', 'No:', 'INV-1042'],
+    ['12/03/2024'],
+    ['Milk', '3.50'],
+    ['Bread', '2.25'],
+    ['Tax', '0.58'],
+    ['TOTAL', '$6.33'],
+]
+# Size of the rendered receipt; its lines are close enough to form one text region.
+RECEIPT_SIZE = (400, 120)
+LINE_SPACING = 12
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    Parse a request mix such as "index=4,upload=1" into endpoint weights.
+    """
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{name}'. Choose from: {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def install_ocr_stub(latency_ms: float) -> None:
+    """
+    Replace the Tesseract calls used by the app with a deterministic stub
+    that returns the same receipt after a fixed delay. The receipt is only
+    returned for images at least half the receipt's height (its text region
+    or the whole page), so small crops do not each yield a full receipt.
+    """
+    def image_to_data(image, config='', output_type=None, **kwargs):
+        time.sleep(latency_ms / 1000)
+        data: Dict[str, List[Any]] = {key: [] for key in
+                                      ('text', 'conf', 'block_num', 'par_num', 'line_num',
+                                       'left', 'top', 'width', 'height')}
+        if image.height < RECEIPT_SIZE[1] / 2:
+            return data
+        for line_num, words in enumerate(STUB_RECEIPT, start=1):
+            for word_num, word in enumerate(words):
+                for key, value in zip(data, (word, 96, 1, 1, line_num,
+                                             10 + 80 * word_num, 20 * line_num, 70, 16)):
+                    data[key].append(value)
+        return data
+
+    def image_to_string(image, config='', **kwargs):
+        time.sleep(latency_ms / 1000)
+        return '\n'.join(' '.join(words) for words in STUB_RECEIPT)
+
+    pytesseract.image_to_data = image_to_data
+    pytesseract.image_to_string = image_to_string
+
+
+def make_receipt_image(index: int) -> bytes:
+    """
+    Render a small, unique receipt image so every upload is a distinct blob.
+    """
+    img = Image.new('L', RECEIPT_SIZE, 255)
+    draw = ImageDraw.Draw(img)
+    for line_num, words in enumerate(STUB_RECEIPT):
+        draw.text((20, 10 + LINE_SPACING * line_num), ' '.join(words), fill=0)
+    draw.text((20, 10 + LINE_SPACING * len(STUB_RECEIPT)), f"Ref {index}", fill=0)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class LockErrorHandler(logging.Handler):
+    """
+    Count log records that report SQLite lock contention.
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if record.exc_info and record.exc_info[1] is not None:
+            message += f" {record.exc_info[1]}"
+        if 'database is locked' in message or 'database table is locked' in message:
+            with self._lock:
+                self.count += 1
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(samples: List[Tuple[str, float, bool]], elapsed: float) -> Dict[str, Any]:
+    """
+    Build per-endpoint and overall statistics from (endpoint, seconds, ok) samples.
+    """
+    groups: Dict[str, List[Tuple[float, bool]]] = {}
+    for name, seconds, ok in samples:
+        groups.setdefault(name, []).append((seconds, ok))
+    groups['all'] = [(seconds, ok) for _, seconds, ok in samples]
+
+    report = {}
+    for name, results in groups.items():
+        latencies = sorted(seconds * 1000 for seconds, _ in results)
+        errors = sum(1 for _, ok in results if not ok)
+        report[name] = {
+            'requests': len(results),
+            'errors': errors,
+            'error_rate': errors / len(results) if results else 0.0,
+            'throughput_rps': len(results) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1] if latencies else 0.0,
+        }
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=300, help='Total number of requests to send.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients.')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'Endpoint weights (default: {DEFAULT_MIX}).')
+    parser.add_argument('--seed-receipts', type=int, default=200, help='Receipts to create before the run.')
+    parser.add_argument('--ocr-latency-ms', type=float, default=20.0, help='Delay of each stubbed OCR call.')
+    parser.add_argument('--random-seed', type=int, default=1, help='Seed for the request order.')
+    parser.add_argument('--max-error-rate', type=float, default=0.0, help='Fail above this overall error rate.')
+    parser.add_argument('--max-p99-ms', type=float, default=None, help='Fail above this overall p99 latency.')
+    parser.add_argument('--allow-lock-errors', action='store_true', help='Do not fail on SQLite lock errors.')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+    args = parser.parse_args()
+
+    # Point the app at a throwaway database and upload folder before it is imported.
+    workdir = tempfile.mkdtemp(prefix='receipts-loadtest-')
+    os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'receipts.db')}"
+    os.environ['STORAGE_SWEEP_INTERVAL'] = '0'
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    install_ocr_stub(args.ocr_latency_ms)
+
+    from sqlalchemy import event
+    from app import app, extract_items
+    from extensions import db
+    from models import Receipt, ReceiptItem
+
+    app.logger.setLevel(logging.WARNING)
+    lock_errors = LockErrorHandler()
+    app.logger.addHandler(lock_errors)
+
+    with app.app_context():
+        db.create_all()
+        start_date = datetime(2024, 1, 1)
+        for i in range(args.seed_receipts):
+            db.session.add(Receipt(
+                merchant=f"Merchant {i % 25}",
+                date_time=start_date + timedelta(days=i % 365),
+                total_amount=Decimal(f"{(i % 90) + 10}.99"),
+                tax=Decimal('1.00'),
+                discount=Decimal('0.00'),
+                ocr_text=f"Merchant {i % 25} TOTAL {(i % 90) + 10}.99",
+                category=('grocery', 'dining', 'travel', 'others')[i % 4]
+            ))
+        db.session.commit()
+        engine = db.engine
+
+    # Connections checked out from the pool and not yet returned.
+    pool_state = {'checked_out': 0}
+    pool_lock = threading.Lock()
+
+    def on_checkout(*_):
+        with pool_lock:
+            pool_state['checked_out'] += 1
+
+    def on_checkin(*_):
+        with pool_lock:
+            pool_state['checked_out'] -= 1
+
+    event.listen(engine, 'checkout', on_checkout)
+    event.listen(engine, 'checkin', on_checkin)
+
+    rng = random.Random(args.random_seed)
+    names = list(args.mix)
+    plan = rng.choices(names, weights=[args.mix[name] for name in names], k=args.requests)
+    local = threading.local()
+
+    def send(index: int, name: str) -> Tuple[str, float, bool]:
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        method, path, expected = ENDPOINTS[name]
+        kwargs: Dict[str, Any] = {}
+        if name == 'upload':
+            kwargs['data'] = {'receipt_files': (io.BytesIO(make_receipt_image(index)), f"receipt_{index}.jpg")}
+        elif name == 'ocr_preview':
+            kwargs['data'] = {'file': (io.BytesIO(make_receipt_image(index)), 'receipt.jpg')}
+        elif name == 'voice_search':
+            kwargs['data'] = {'query': f"Merchant {index % 25}"}
+        started = time.perf_counter()
+        try:
+            response = local.client.open(path, method=method, **kwargs)
+            ok = response.status_code == expected
+            response.close()
+        except Exception:
+            app.logger.exception(f"Request {index} to {path} raised")
+            ok = False
+        return name, time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        samples = list(executor.map(send, range(len(plan)), plan))
+    elapsed = time.perf_counter() - started
+
+    # Every successful upload must have saved exactly one receipt with the
+    # stub receipt's items, once each; /upload redirects even when processing
+    # fails, so the status code alone is not enough. A wrong item count means
+    # the OCR stub saw the receipt split across crops (items dropped) or
+    # repeated in several of them (items duplicated).
+    expected_items = len(extract_items([' '.join(words) for words in STUB_RECEIPT]))
+    with app.app_context():
+        saved_receipts = Receipt.query.count() - args.seed_receipts
+        item_counts = dict(db.session.query(ReceiptItem.receipt_id, db.func.count(ReceiptItem.id))
+                           .group_by(ReceiptItem.receipt_id).all())
+        uploaded_ids = [receipt_id for (receipt_id,) in
+                        db.session.query(Receipt.id).filter(Receipt.source_file.isnot(None))]
+    wrong_items = sum(1 for receipt_id in uploaded_ids if item_counts.get(receipt_id, 0) != expected_items)
+    uploaded = sum(1 for name, _, ok in samples if name == 'upload' and ok)
+
+    report = {
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'mix': args.mix,
+            'ocr_latency_ms': args.ocr_latency_ms,
+            'elapsed_s': elapsed,
+        },
+        'endpoints': summarize(samples, elapsed),
+        'db_lock_errors': lock_errors.count,
+        'leaked_connections': pool_state['checked_out'],
+        'uploads': {'succeeded': uploaded, 'receipts_saved': saved_receipts,
+                    'receipts_with_wrong_items': wrong_items},
+    }
+
+    failures = []
+    overall = report['endpoints']['all']
+    if overall['error_rate'] > args.max_error_rate:
+        failures.append(f"error rate {overall['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    if args.max_p99_ms is not None and overall['p99_ms'] > args.max_p99_ms:
+        failures.append(f"p99 {overall['p99_ms']:.0f} ms > {args.max_p99_ms:.0f} ms")
+    if lock_errors.count and not args.allow_lock_errors:
+        failures.append(f"{lock_errors.count} database lock error(s)")
+    if pool_state['checked_out']:
+        failures.append(f"{pool_state['checked_out']} database connection(s) never returned to the pool")
+    if saved_receipts != uploaded:
+        failures.append(f"{uploaded} successful upload(s) but {saved_receipts} receipt(s) saved")
+    if wrong_items:
+        failures.append(f"{wrong_items} uploaded receipt(s) without exactly {expected_items} item(s)")
+    report['failures'] = failures
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{args.requests} requests, concurrency {args.concurrency}, {elapsed:.2f} s")
+        print(f"{'endpoint':<14}{'reqs':>6}{'errors':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+        for name, stats in report['endpoints'].items():
+            print(f"{name:<14}{stats['requests']:>6}{stats['errors']:>8}{stats['throughput_rps']:>9.1f}"
+                  f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['max_ms']:>9.1f}")
+        print(f"DB lock errors: {lock_errors.count}")
+        print(f"Leaked DB connections: {pool_state['checked_out']}")
+        print(f"Receipts saved: {saved_receipts} for {uploaded} successful upload(s), "
+              f"{wrong_items} with the wrong number of items")
+        print('FAIL: ' + '; '.join(failures) if failures else 'PASS')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -74,6 +74,16 @@ class Receipt(db.Model, TimestampMixin):
         nullable=True,
         comment="Merchant location or other geographical info"
     )
+    source_file = db.Column(
+        db.String(255),
+        nullable=True,
+        comment="Uploaded image the receipt was scanned from"
+    )
+    ocr_layout = db.Column(
+        db.JSON,
+        nullable=True,
+        comment="Image size and bounding boxes of the OCR lines each field came from"
+    )
 
     # Define relationship to ReceiptItem with cascade deletion.
     items = db.relationship(
@@ -99,6 +109,8 @@ class Receipt(db.Model, TimestampMixin):
             'ocr_text': self.ocr_text,
             'category': self.category,
             'location': self.location,
+            'source_file': self.source_file,
+            'ocr_layout': self.ocr_layout,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'items': [item.to_dict() for item in self.items] if self.items else []
@@ -110,7 +122,7 @@ class Receipt(db.Model, TimestampMixin):
         Only updates fields that are present in the data dictionary.
         """
         for field in ['bill_no', 'merchant', 'date_time', 'total_amount', 'tax', 'discount',
-                      'ocr_text', 'category', 'location']:
+                      'ocr_text', 'category', 'location', 'source_file', 'ocr_layout']:
             if field in data:
                 setattr(self, field, data[field])
 
@@ -0,0 +1,298 @@
+# storage.py
+import os
+import re
+import time
+import shutil
+import hashlib
+import tempfile
+import posixpath
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Dict, Any, Iterator, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Stored names are the SHA-256 of the original upload, e.g.
+# "<digest>.jpg" (original), "<digest>_preprocessed.jpg" and "<digest>.txt" (derived).
+BLOB_NAME = re.compile(r'^(?P<digest>[0-9a-f]{64})(?P<suffix>_preprocessed\.jpg|\.txt|\.[a-z0-9]+)$')
+DERIVED_SUFFIXES = ('_preprocessed.jpg', '.txt')
+TMP_DIR = 'tmp'
+# Held while a sweep runs, so only one process (e.g. one gunicorn worker) sweeps at a time.
+SWEEP_LOCK = '.sweep.lock'
+
+
+@contextmanager
+def try_lock(path: str) -> Iterator[bool]:
+    """
+    Take a non-blocking exclusive lock on a file. Yields False if another
+    process (or thread) already holds it.
+    """
+    with open(path, 'a+b') as f:
+        try:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class BlobStore:
+    """
+    Content-addressed storage for uploaded receipts.
+    Originals are stored under hash-prefix shard directories
+    (<root>/ab/cd/abcd...ef.jpg), so identical uploads share one file and
+    different uploads with the same name never collide. Derived artifacts
+    (preprocessed image, OCR text) live next to their original. All writes
+    go through a temporary file and an atomic rename.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(self.root, TMP_DIR), exist_ok=True)
+
+    def relative_path(self, digest: str, suffix: str) -> str:
+        """
+        Return the path of a blob relative to the store root. Relative paths
+        always use '/' so they can be stored and served on any platform.
+        """
+        return posixpath.join(digest[:2], digest[2:4], f"{digest}{suffix}")
+
+    def path_for(self, relative_path: str) -> str:
+        """
+        Return the absolute path of a blob from its relative path.
+        """
+        return os.path.join(self.root, *relative_path.split('/'))
+
+    def _commit(self, temp_path: str, relative_path: str) -> str:
+        """
+        Atomically move a finished temporary file to its final location.
+        """
+        final_path = self.path_for(relative_path)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        try:
+            os.replace(temp_path, final_path)
+        except FileNotFoundError:
+            # The sweeper removed the (empty) shard directory in between.
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(temp_path, final_path)
+        return final_path
+
+    def put_stream(self, stream: BinaryIO, extension: str, chunk_size: int = 64 * 1024) -> Tuple[str, str]:
+        """
+        Store an upload stream, hashing it while it is copied to a temporary
+        file. Returns the digest and the path relative to the store root.
+        """
+        digest = hashlib.sha256()
+        temp_path = self.temp_path()
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(chunk_size), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+            relative_path = self.relative_path(digest.hexdigest(), f".{extension.lower()}")
+            self._commit(temp_path, relative_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest.hexdigest(), relative_path
+
+    def put_bytes(self, data: bytes, extension: str) -> Tuple[str, str]:
+        """
+        Store an in-memory upload. Returns the digest and the relative path.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        relative_path = self.relative_path(digest, f".{extension.lower()}")
+        try:
+            # Already stored: refresh its age so the sweeper keeps it.
+            os.utime(self.path_for(relative_path))
+        except FileNotFoundError:
+            self.write_atomic(relative_path, data)
+        return digest, relative_path
+
+    def write_atomic(self, relative_path: str, data: bytes) -> str:
+        """
+        Write data to a blob path via a temporary file and atomic rename.
+        """
+        temp_path = self.temp_path()
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            return self._commit(temp_path, relative_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def temp_path(self, suffix: str = '') -> str:
+        """
+        Reserve a temporary file inside the store for a writer that needs a
+        path (e.g. PIL's save). Commit it with commit_temp().
+        """
+        fd, path = tempfile.mkstemp(dir=os.path.join(self.root, TMP_DIR), suffix=suffix)
+        os.close(fd)
+        return path
+
+    def commit_temp(self, temp_path: str, final_path: str) -> str:
+        """
+        Atomically move a reserved temporary file to an absolute path in the store.
+        """
+        os.replace(temp_path, final_path)
+        return final_path
+
+    def iter_blobs(self) -> Iterator[Tuple[str, str, os.stat_result]]:
+        """
+        Yield (relative_path, suffix, stat) for every blob in the shard directories.
+        Directories removed while iterating are skipped.
+        """
+        for first, first_dir in self._shard_dirs(self.root):
+            for second, second_dir in self._shard_dirs(first_dir):
+                try:
+                    names = os.listdir(second_dir)
+                except FileNotFoundError:
+                    continue
+                for name in names:
+                    match = BLOB_NAME.match(name)
+                    if not match:
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(second_dir, name))
+                    except FileNotFoundError:
+                        continue
+                    yield posixpath.join(first, second, name), match.group('suffix'), stat
+
+    @staticmethod
+    def _shard_dirs(directory: str) -> Iterator[Tuple[str, str]]:
+        """
+        Yield (name, path) for the two-character shard directories in a directory.
+        """
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(directory, name)
+            if len(name) == 2 and os.path.isdir(path):
+                yield name, path
+
+    def sweep(self, referenced: Set[str], retention_days: int = 0,
+              derived_retention_hours: int = 24, orphan_grace_hours: int = 24,
+              now: Optional[float] = None,
+              on_remove: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Apply the retention policy:
+          - derived artifacts older than derived_retention_hours are removed
+            (they can be regenerated and the OCR text is in the database);
+          - originals not referenced by any receipt are removed after
+            orphan_grace_hours;
+          - referenced originals are removed after retention_days (0 keeps
+            them forever);
+          - abandoned temporary files and empty shard directories are removed.
+        on_remove is called with the relative path of each original right after
+        it is removed. Returns the relative paths of removed originals and the
+        bytes freed; 'skipped' is True when another sweep holds the lock.
+        """
+        stats: Dict[str, Any] = {'removed_originals': [], 'removed_derived': 0, 'freed_bytes': 0, 'skipped': False}
+        with try_lock(os.path.join(self.root, SWEEP_LOCK)) as locked:
+            if not locked:
+                stats['skipped'] = True
+                return stats
+            self._sweep(stats, referenced, retention_days, derived_retention_hours, orphan_grace_hours,
+                        now if now is not None else time.time(), on_remove)
+        return stats
+
+    def _sweep(self, stats: Dict[str, Any], referenced: Set[str], retention_days: int,
+               derived_retention_hours: int, orphan_grace_hours: int, now: float,
+               on_remove: Optional[Callable[[str], None]]) -> None:
+        """
+        Body of sweep(), run while holding the sweep lock. Updates stats in place.
+        Each blob is re-checked right before it is removed, so one re-uploaded
+        after the listing is kept; only a re-upload landing between that check
+        and the remove itself can still be lost.
+        """
+        for relative_path, suffix, stat in list(self.iter_blobs()):
+            age_hours = (now - stat.st_mtime) / 3600
+            if suffix in DERIVED_SUFFIXES:
+                expired = age_hours > derived_retention_hours
+            elif relative_path in referenced:
+                expired = retention_days > 0 and age_hours > retention_days * 24
+            else:
+                expired = age_hours > orphan_grace_hours
+            if not expired:
+                continue
+            path = self.path_for(relative_path)
+            try:
+                # The listing is a snapshot: an identical upload may have
+                # replaced the blob (new inode) or refreshed its mtime since.
+                current = os.stat(path)
+                if (current.st_ino, current.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            stats['freed_bytes'] += stat.st_size
+            if suffix in DERIVED_SUFFIXES:
+                stats['removed_derived'] += 1
+            else:
+                stats['removed_originals'].append(relative_path)
+                if on_remove:
+                    on_remove(relative_path)
+
+        tmp_dir = os.path.join(self.root, TMP_DIR)
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > orphan_grace_hours * 3600:
+                    os.remove(path)
+                    stats['freed_bytes'] += stat.st_size
+            except FileNotFoundError:
+                continue
+
+        # An upload may recreate or fill a shard directory at any point, so
+        # rmdir simply fails (ENOTEMPTY/ENOENT) and the directory is kept.
+        for _, first_dir in self._shard_dirs(self.root):
+            for _, second_dir in self._shard_dirs(first_dir):
+                try:
+                    os.rmdir(second_dir)
+                except OSError:
+                    pass
+            try:
+                os.rmdir(first_dir)
+            except OSError:
+                pass
+
+    def usage(self) -> Dict[str, Any]:
+        """
+        Report file counts and bytes for originals, derived artifacts,
+        temporary files and legacy files stored directly in the root.
+        """
+        report = {kind: {'files': 0, 'bytes': 0} for kind in ('originals', 'derived', 'tmp', 'legacy')}
+        for _, suffix, stat in self.iter_blobs():
+            kind = 'derived' if suffix in DERIVED_SUFFIXES else 'originals'
+            report[kind]['files'] += 1
+            report[kind]['bytes'] += stat.st_size
+        for kind, directory in (('tmp', os.path.join(self.root, TMP_DIR)), ('legacy', self.root)):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if name != SWEEP_LOCK and os.path.isfile(path):
+                    report[kind]['files'] += 1
+                    report[kind]['bytes'] += os.path.getsize(path)
+        report['total_bytes'] = sum(entry['bytes'] for entry in report.values())
+        disk = shutil.disk_usage(self.root)
+        report['disk'] = {'total': disk.total, 'used': disk.used, 'free': disk.free}
+        return report
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+import pytesseract
+
+# Make the top-level modules (app, storage, models, ...) importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import loadtest  # noqa: E402
+
+API_KEY = 'test-key'
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    A fresh app with its own database and upload folder under tmp_path,
+    with Tesseract replaced by the load-test stub.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('DATABASE_URI', f"sqlite:///{tmp_path / 'receipts.db'}")
+    monkeypatch.setenv('STORAGE_SWEEP_INTERVAL', '0')
+    monkeypatch.setenv('API_KEYS', API_KEY)
+    # Registered with monkeypatch so the real functions are restored afterwards.
+    for name in ('image_to_data', 'image_to_string'):
+        monkeypatch.setattr(pytesseract, name, getattr(pytesseract, name))
+    loadtest.install_ocr_stub(0)
+
+    import app as app_module
+    return app_module.create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def app_module(app):
+    """The app module, imported only once the test environment is in place."""
+    import app as module
+    return module
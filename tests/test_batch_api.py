@@ -0,0 +1,157 @@
+import io
+import tarfile
+import time
+import zipfile
+
+import pdf2image
+from PIL import Image
+
+from conftest import API_KEY
+from extensions import db
+from loadtest import make_receipt_image
+from models import Receipt
+
+HEADERS = {'X-API-Key': API_KEY}
+
+
+def post_batch(client, files, mode=None):
+    query = f"?mode={mode}" if mode else ''
+    return client.post(f"/api/receipts/batch{query}", headers=HEADERS,
+                       data={'files': [(io.BytesIO(data), name) for name, data in files]})
+
+
+def wait_for(client, job_id, timeout=10):
+    """Poll a job until it is finished and return the final response."""
+    deadline = time.time() + timeout
+    while True:
+        response = client.get(f"/api/jobs/{job_id}", headers=HEADERS)
+        if response.status_code != 200 or response.get_json()['status'] != 'pending' or time.time() > deadline:
+            return response
+        time.sleep(0.02)
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def tar_gz_bytes(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_requires_api_key(client):
+    response = client.post('/api/receipts/batch', data={'files': (io.BytesIO(b'x'), 'a.jpg')})
+    assert response.status_code == 401
+    response = client.post('/api/receipts/batch', headers={'X-API-Key': 'wrong'},
+                           data={'files': (io.BytesIO(b'x'), 'a.jpg')})
+    assert response.status_code == 401
+
+
+def test_sync_batch_processes_files(client):
+    response = post_batch(client, [('a.jpg', make_receipt_image(1)), ('notes.txt', b'hello')])
+    assert response.status_code == 200
+    first, second = response.get_json()['results']
+    assert first['status'] == 'processed' and first['receipt_id']
+    assert first['details']['total_amount'] == '$6.33'
+    assert second['status'] == 'skipped'
+
+
+def test_archive_members_are_processed(client):
+    members = [('receipts/a.jpg', make_receipt_image(1)), ('receipts/b.jpg', make_receipt_image(2)),
+               ('readme.txt', b'ignored')]
+    response = post_batch(client, [('batch.zip', zip_bytes(members)), ('batch.tar.gz', tar_gz_bytes(members))],
+                          mode='sync')
+    results = response.get_json()['results']
+    assert [result['filename'] for result in results] == ['a.jpg', 'b.jpg', 'a.jpg', 'b.jpg']
+    assert all(result['status'] == 'processed' for result in results)
+
+
+def test_archives_default_to_async(client):
+    response = post_batch(client, [('batch.zip', zip_bytes([('a.jpg', make_receipt_image(1))]))])
+    assert response.status_code == 202
+    (job,) = response.get_json()['jobs']
+    assert wait_for(client, job['job_id']).get_json()['status'] == 'processed'
+
+
+def test_corrupt_archive_is_skipped(client):
+    response = post_batch(client, [('bad.zip', b'PK\x03\x04 not really a zip'), ('ok.jpg', make_receipt_image(1))],
+                          mode='sync')
+    assert response.status_code == 200
+    bad, ok = response.get_json()['results']
+    assert bad == {'filename': 'bad.zip', 'status': 'skipped', 'error': 'Unreadable archive.'}
+    assert ok['status'] == 'processed'
+
+
+def test_oversized_file_is_skipped(app, client):
+    app.config['MAX_CONTENT_LENGTH'] = 1024
+    response = post_batch(client, [('big.jpg', make_receipt_image(1) + b'\0' * 2048)])
+    (result,) = response.get_json()['results']
+    assert result == {'filename': 'big.jpg', 'status': 'skipped', 'error': 'File too large.'}
+
+
+def test_queue_full_is_skipped(app, client):
+    app.config['API_KEY_MAX_QUEUED'] = 0
+    response = post_batch(client, [('a.jpg', make_receipt_image(1))])
+    (result,) = response.get_json()['results']
+    assert result['status'] == 'skipped' and result['error'] == 'Queue full, retry later.'
+
+    app.config['API_KEY_MAX_QUEUED'] = 1000
+    app.config['API_KEY_MAX_QUEUED_BYTES'] = 100
+    response = post_batch(client, [('a.jpg', make_receipt_image(1))])
+    (result,) = response.get_json()['results']
+    assert result['status'] == 'skipped' and result['error'] == 'Queue full, retry later.'
+
+
+def test_job_is_returned_once(client):
+    response = post_batch(client, [('a.jpg', make_receipt_image(1))], mode='async')
+    assert response.status_code == 202
+    (job,) = response.get_json()['jobs']
+    assert job['status'] == 'pending'
+
+    first = wait_for(client, job['job_id'])
+    assert first.status_code == 200
+    assert first.get_json()['status'] == 'processed'
+    assert first.get_json()['job_id'] == job['job_id']
+    assert client.get(f"/api/jobs/{job['job_id']}", headers=HEADERS).status_code == 404
+
+
+def test_jobs_of_other_keys_are_hidden(app, client):
+    response = post_batch(client, [('a.jpg', make_receipt_image(1))], mode='async')
+    (job,) = response.get_json()['jobs']
+    assert client.get(f"/api/jobs/{job['job_id']}", headers={'X-API-Key': 'other'}).status_code == 404
+
+
+def test_unpolled_jobs_expire(app, client):
+    # One slot per key: jobs run in order, so the sync request below only
+    # returns once the async job has finished.
+    app.config['API_KEY_MAX_CONCURRENCY'] = 1
+    (stale,) = post_batch(client, [('a.jpg', make_receipt_image(1))], mode='async').get_json()['jobs']
+    post_batch(client, [('b.jpg', make_receipt_image(2))], mode='sync')
+
+    app.config['BATCH_JOB_TTL'] = 0
+    (fresh,) = post_batch(client, [('c.jpg', make_receipt_image(3))], mode='async').get_json()['jobs']
+
+    assert client.get(f"/api/jobs/{stale['job_id']}", headers=HEADERS).status_code == 404
+    assert wait_for(client, fresh['job_id']).get_json()['status'] == 'processed'
+
+
+def test_pdf_receipts_have_no_layout(app, client, monkeypatch):
+    # A one-page PDF, rendered without Poppler.
+    monkeypatch.setattr(pdf2image, 'convert_from_bytes',
+                        lambda data, **kwargs: [Image.open(io.BytesIO(make_receipt_image(1)))])
+    (result,) = post_batch(client, [('scan.pdf', b'%PDF-1.4 stub')]).get_json()['results']
+    assert result['status'] == 'processed'
+    with app.app_context():
+        receipt = db.session.get(Receipt, result['receipt_id'])
+        assert receipt.source_file.endswith('.pdf')
+        assert receipt.ocr_layout is None
+    assert b'field-box' not in client.get(f"/receipt/{receipt.id}/edit").data
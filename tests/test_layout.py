@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import pytesseract
+from PIL import Image, ImageDraw
+
+from extensions import db
+from test_ocr import tesseract_data
+
+
+def blank_page(width=600, height=500):
+    img = Image.new('L', (width, height), 255)
+    return img, ImageDraw.Draw(img)
+
+
+def draw_lines(draw, top, count, spacing=14):
+    for i in range(count):
+        draw.text((50, top + i * spacing), f"Item {i} description here   {i}.99", fill=0)
+
+
+def threshold(img):
+    return img.point(lambda v: 0 if v < 128 else 255, mode='1')
+
+
+def test_text_block_is_one_region(app_module):
+    img, draw = blank_page()
+    draw_lines(draw, 40, 6)
+    (region,) = app_module.find_text_regions(threshold(img))
+    left, top, right, bottom = region
+    assert left < 50 and top < 40 and bottom > 40 + 5 * 14
+    # Trimmed to the text, not the page width.
+    assert right < 300
+
+
+def test_separate_blocks_do_not_overlap(app_module):
+    img, draw = blank_page()
+    draw_lines(draw, 40, 3)
+    draw_lines(draw, 110, 3)
+    first, second = app_module.find_text_regions(threshold(img))
+    assert first[3] <= second[1]
+    assert first[1] < 40 and second[3] > 110 + 2 * 14
+
+
+def test_barcode_band_is_skipped(app_module):
+    img, draw = blank_page()
+    draw_lines(draw, 40, 4)
+    for x in range(60, 400, 7):
+        draw.rectangle((x, 160, x + 3, 240), fill=0)
+    draw_lines(draw, 280, 4)
+    regions = app_module.find_text_regions(threshold(img))
+    assert len(regions) == 2
+    assert all(bottom <= 160 or top >= 240 for _, top, _, bottom in regions)
+
+
+def test_solid_logo_is_skipped(app_module):
+    img, draw = blank_page()
+    draw.rectangle((200, 20, 400, 140), fill=0)
+    draw_lines(draw, 180, 5)
+    (region,) = app_module.find_text_regions(threshold(img))
+    assert region[1] >= 140
+
+
+def test_shadowed_border_is_ignored(app_module):
+    img, draw = blank_page()
+    draw.rectangle((0, 0, 25, 499), fill=0)
+    draw.rectangle((575, 0, 599, 499), fill=0)
+    draw_lines(draw, 100, 5)
+    (region,) = app_module.find_text_regions(threshold(img))
+    left, top, right, bottom = region
+    assert left > 25 and right < 575
+    assert top < 100 and bottom < 200
+
+
+def test_blank_page_has_no_regions(app_module):
+    img, _ = blank_page()
+    assert app_module.find_text_regions(threshold(img)) == []
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_ocr_regions_offsets_word_boxes(app_module, monkeypatch, parallel):
+    img, draw = blank_page()
+    draw_lines(draw, 40, 3)
+    draw_lines(draw, 110, 3)
+    bin_img = threshold(img)
+    regions = app_module.find_text_regions(bin_img)
+    monkeypatch.setattr(pytesseract, 'image_to_data',
+                        lambda image, config='', output_type=None: tesseract_data([['word']], 90))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        lines, conf = app_module.ocr_regions(bin_img, executor=executor if parallel else None)
+
+    assert conf == 90
+    # One stub line per region, moved from crop to page coordinates.
+    assert [line['words'][0][1] for line in lines] == [
+        (left + 10, top + 20, left + 80, top + 36) for left, top, _, _ in regions
+    ]
+
+
+def test_field_boxes_pick_the_line_each_field_came_from(app_module):
+    texts = ['GREEN VALLEY MARKET', 'Milk 3.50', 'Bill No: INV-1042', '12/03/2024', 'Tax 3.50', 'TOTAL $6.33']
+    layout = {'width': 100, 'height': 100,
+              'lines': [{'text': text, 'box': [0, 10 * i, 50, 10 * i + 8]} for i, text in enumerate(texts)]}
+    details = app_module.extract_receipt_details('\n'.join(texts))
+
+    boxes = app_module.field_boxes(details, layout)
+
+    assert details['tax'] == '3.50'
+    assert boxes['tax'] == [0, 40, 50, 48]  # the Tax line, not "Milk 3.50"
+    assert boxes['merchant'] == [0, 0, 50, 8]
+    assert boxes['bill_no'] == [0, 20, 50, 28]
+    assert boxes['date_time'] == [0, 30, 50, 38]
+    assert boxes['total_amount'] == [0, 50, 50, 58]
+    assert 'discount' not in boxes
+
+
+def test_field_boxes_skip_edited_values(app_module):
+    layout = {'width': 100, 'height': 100, 'lines': [{'text': 'TOTAL $6.33', 'box': [0, 0, 50, 8]}]}
+    assert app_module.field_boxes({'total_amount': '$7.00'}, layout) == {}
+
+
+def test_upgrade_schema_tolerates_a_concurrent_upgrade(app, app_module, monkeypatch):
+    # Another worker added source_file after this one inspected the table.
+    real_inspect = db.inspect
+    calls = []
+
+    def stale_inspect(engine):
+        inspector = real_inspect(engine)
+        if calls:
+            return inspector
+        calls.append(engine)
+        get_columns = inspector.get_columns
+        inspector.get_columns = lambda table, **kw: [
+            column for column in get_columns(table, **kw) if column['name'] != 'source_file'
+        ]
+        return inspector
+
+    monkeypatch.setattr(db, 'inspect', stale_inspect)
+    with app.app_context():
+        app_module.upgrade_schema()
+        assert calls
@@ -0,0 +1,74 @@
+import io
+
+import pytesseract
+
+from loadtest import RECEIPT_SIZE, make_receipt_image
+
+RECEIPT = [['GREEN', 'VALLEY', 'MARKET'], ['12/03/2024'], ['TOTAL', '$6.33']]
+NO_DATE = [['GREEN', 'VALLEY', 'MARKET'], ['TOTAL', '$6.33']]
+
+
+def tesseract_data(lines, conf):
+    """Build an image_to_data result holding the given lines of words."""
+    data = {key: [] for key in ('text', 'conf', 'block_num', 'par_num', 'line_num',
+                                'left', 'top', 'width', 'height')}
+    for line_num, words in enumerate(lines, start=1):
+        for word_num, word in enumerate(words):
+            for key, value in zip(data, (word, conf, 1, 1, line_num, 10 + 80 * word_num, 20 * line_num, 70, 16)):
+                data[key].append(value)
+    return data
+
+
+def stub_passes(monkeypatch, fast, full):
+    """
+    Stub Tesseract with different (lines, confidence) results for the fast
+    pass on the downscaled image and the retry on the full-resolution image.
+    Returns the list of passes that ran.
+    """
+    passes = []
+
+    def image_to_data(image, config='', output_type=None, **kwargs):
+        name = 'full' if image.size == RECEIPT_SIZE else 'fast'
+        passes.append(name)
+        lines, conf = fast if name == 'fast' else full
+        return tesseract_data([[f"{name.upper()}-MARK"]] + lines, conf)
+
+    monkeypatch.setattr(pytesseract, 'image_to_data', image_to_data)
+    return passes
+
+
+def preview(app, client):
+    # Downscale the 400 px wide receipt for the fast pass.
+    app.config['OCR_FAST_MAX_SIDE'] = RECEIPT_SIZE[0] // 2
+    response = client.post('/ocr_preview', data={'file': (io.BytesIO(make_receipt_image(1)), 'r.jpg')})
+    assert response.status_code == 200
+    return response.get_json()['ocr_text']
+
+
+def test_fast_pass_accepted(app, client, monkeypatch):
+    passes = stub_passes(monkeypatch, fast=(RECEIPT, 96), full=(RECEIPT, 96))
+    text = preview(app, client)
+    assert 'full' not in passes
+    assert 'FAST-MARK' in text and '12/03/2024' in text
+
+
+def test_low_confidence_retries_at_full_resolution(app, client, monkeypatch):
+    passes = stub_passes(monkeypatch, fast=(RECEIPT, 50), full=(RECEIPT, 90))
+    text = preview(app, client)
+    assert passes[-1] == 'full' and passes.count('full') == 1
+    assert 'FULL-MARK' in text and 'FAST-MARK' not in text
+
+
+def test_missing_field_retries_at_full_resolution(app, client, monkeypatch):
+    passes = stub_passes(monkeypatch, fast=(NO_DATE, 96), full=(RECEIPT, 80))
+    text = preview(app, client)
+    assert 'full' in passes
+    assert 'FULL-MARK' in text and '12/03/2024' in text
+
+
+def test_better_pass_is_kept(app, client, monkeypatch):
+    # The retry finds no fields at all, so the fast pass wins despite its missing date.
+    passes = stub_passes(monkeypatch, fast=(NO_DATE, 96), full=([['smudge']], 30))
+    text = preview(app, client)
+    assert 'full' in passes
+    assert 'FAST-MARK' in text and 'FULL-MARK' not in text
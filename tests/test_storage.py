@@ -0,0 +1,145 @@
+import io
+import os
+import time
+
+import pytest
+
+import storage
+from storage import BlobStore
+
+HOUR = 3600
+
+
+def age(store, relative_path, hours, now):
+    """Backdate a blob so it is `hours` old at `now`."""
+    mtime = now - hours * HOUR
+    os.utime(store.path_for(relative_path), (mtime, mtime))
+
+
+def test_relative_paths_use_forward_slashes(tmp_path):
+    store = BlobStore(str(tmp_path))
+    digest, relative_path = store.put_bytes(b'receipt', 'JPG')
+    assert relative_path == f"{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+    assert os.path.isfile(store.path_for(relative_path))
+    assert [path for path, _, _ in store.iter_blobs()] == [relative_path]
+
+
+def test_unreferenced_original_expires_after_grace(tmp_path):
+    store = BlobStore(str(tmp_path))
+    now = time.time()
+    _, fresh = store.put_bytes(b'fresh', 'jpg')
+    _, stale = store.put_bytes(b'stale', 'jpg')
+    age(store, fresh, 1, now)
+    age(store, stale, 25, now)
+
+    stats = store.sweep(set(), orphan_grace_hours=24, now=now)
+
+    assert stats['removed_originals'] == [stale]
+    assert os.path.exists(store.path_for(fresh))
+    assert not os.path.exists(store.path_for(stale))
+    # The stale blob's shard directories were emptied and removed.
+    assert not os.path.exists(os.path.dirname(store.path_for(stale)))
+
+
+def test_referenced_original_is_kept_without_retention(tmp_path):
+    store = BlobStore(str(tmp_path))
+    now = time.time()
+    _, original = store.put_bytes(b'kept', 'jpg')
+    age(store, original, 24 * 365, now)
+
+    stats = store.sweep({original}, retention_days=0, now=now)
+    assert stats['removed_originals'] == []
+    assert os.path.exists(store.path_for(original))
+
+    removed = []
+    stats = store.sweep({original}, retention_days=30, now=now, on_remove=removed.append)
+    assert stats['removed_originals'] == removed == [original]
+
+
+def test_derived_files_expire(tmp_path):
+    store = BlobStore(str(tmp_path))
+    now = time.time()
+    digest, original = store.put_bytes(b'receipt', 'jpg')
+    text = store.relative_path(digest, '.txt')
+    store.write_atomic(text, b'TOTAL 1.00')
+    age(store, text, 25, now)
+
+    stats = store.sweep({original}, derived_retention_hours=24, now=now)
+
+    assert stats['removed_derived'] == 1
+    assert not os.path.exists(store.path_for(text))
+    assert os.path.exists(store.path_for(original))
+
+
+def test_usage_counts_each_kind(tmp_path):
+    store = BlobStore(str(tmp_path))
+    digest, _ = store.put_bytes(b'12345', 'jpg')
+    store.write_atomic(store.relative_path(digest, '.txt'), b'abc')
+    (tmp_path / 'legacy.jpg').write_bytes(b'xy')
+    store.sweep(set())  # leaves its lock file behind, which is not a legacy upload
+
+    report = store.usage()
+
+    assert report['originals'] == {'files': 1, 'bytes': 5}
+    assert report['derived'] == {'files': 1, 'bytes': 3}
+    assert report['legacy'] == {'files': 1, 'bytes': 2}
+    assert report['total_bytes'] == 10
+
+
+def test_sweep_tolerates_concurrent_writer(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path))
+    now = time.time()
+    _, stale = store.put_bytes(b'stale', 'jpg')
+    age(store, stale, 25, now)
+    shard_dir = os.path.dirname(store.path_for(stale))
+    real_rmdir = os.rmdir
+    written = []
+
+    def rmdir_after_upload(path):
+        # An upload lands in the shard directory between the blob removal
+        # and the empty-directory cleanup.
+        if path == shard_dir and not written:
+            written.append(os.path.join(shard_dir, 'f' * 64 + '.jpg'))
+            with open(written[0], 'wb') as f:
+                f.write(b'new upload')
+        real_rmdir(path)
+
+    monkeypatch.setattr(storage.os, 'rmdir', rmdir_after_upload)
+
+    stats = store.sweep(set(), orphan_grace_hours=24, now=now)
+
+    assert stats['removed_originals'] == [stale]
+    assert os.listdir(shard_dir)
+
+
+@pytest.mark.parametrize('reupload', ['put_bytes', 'put_stream'])
+def test_sweep_keeps_blob_reuploaded_after_listing(tmp_path, monkeypatch, reupload):
+    store = BlobStore(str(tmp_path))
+    now = time.time()
+    _, stale = store.put_bytes(b'stale', 'jpg')
+    age(store, stale, 25, now)
+    list_blobs = store.iter_blobs
+
+    def list_then_reupload():
+        yield from list_blobs()
+        # The same receipt is uploaded again after the sweep took its listing:
+        # put_bytes refreshes the blob's mtime, put_stream replaces the file.
+        if reupload == 'put_bytes':
+            store.put_bytes(b'stale', 'jpg')
+        else:
+            store.put_stream(io.BytesIO(b'stale'), 'jpg')
+
+    monkeypatch.setattr(store, 'iter_blobs', list_then_reupload)
+
+    stats = store.sweep(set(), orphan_grace_hours=24, now=now)
+
+    assert stats['removed_originals'] == []
+    assert os.path.exists(store.path_for(stale))
+
+
+def test_only_one_sweep_runs_at_a_time(tmp_path):
+    store = BlobStore(str(tmp_path))
+    with storage.try_lock(os.path.join(str(tmp_path), storage.SWEEP_LOCK)) as locked:
+        assert locked
+        assert store.sweep(set())['skipped']
+    assert not store.sweep(set())['skipped']